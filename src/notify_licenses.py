@@ -1,10 +1,32 @@
 #!/usr/bin/env python3
 import os
+import re
 import sys
 import json
+import gzip
+import hashlib
+import time
 import datetime as dt
-from dateutil import tz
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from types import MappingProxyType
 import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+try:
+    import orjson  # optional: much faster (de)serialization of the export payloads
+except ImportError:
+    orjson = None
+try:
+    import ijson  # optional: streams the (large) transactions download item by item
+except ImportError:
+    ijson = None
+try:
+    import ciso8601  # optional: C ISO-8601 parser for the per-license date checks
+except ImportError:
+    ciso8601 = None
 
 # Required env vars (set as GitHub Secrets in Actions):
 # MP_USER           -> your Atlassian account email
@@ -13,7 +35,10 @@ import requests
 # SLACK_WEBHOOK     -> Slack Incoming Webhook URL
 #
 # Optional:
-# APPS              -> comma-separated app names to include (defaults to all)
+# APPS              -> comma-separated app names or keys to include (defaults to all)
+# MP_CACHE_DIR      -> directory for cached export bodies, gzip-compressed (disabled if unset)
+# MP_CACHE_TTL      -> seconds a cached body is reused without a request (default 3600)
+# REFRESH=1         -> bypass cached bodies for this run (they are rewritten)
 
 def env(name, default=None, required=False):
     v = os.getenv(name, default)
@@ -28,59 +53,131 @@ VENDOR_ID     = env("VENDOR_ID", required=True)
 SLACK_WEBHOOK = env("SLACK_WEBHOOK", required=True)
 DRY_RUN = os.getenv("DRY_RUN", "0") == "1"
 
-CONVERSION_LOOKBACK_DAYS = int(os.getenv("CONVERSION_LOOKBACK_DAYS", "60"))
+_loads = orjson.loads if orjson else json.loads
+# compact UTF-8 bytes either way (the stdlib fallback would otherwise \u-escape every emoji)
+_dumps = orjson.dumps if orjson else (
+    lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+)
+
+# One pooled session for every Marketplace/Slack call, so repeated requests
+# to the same host reuse the keep-alive connection instead of a new TLS handshake.
+# Auth is passed per Marketplace call (MP_AUTH, built once) so credentials never go to Slack.
+MP_AUTH = HTTPBasicAuth(MP_USER, MP_API_TOKEN)
+SESSION = requests.Session()
+SESSION.headers.update({"Accept": "application/json"})
+# Transient 429/5xx on GETs are retried with exponential backoff (honoring Retry-After);
+# once exhausted the last response is returned so raise_for_status() reports it.
+# POSTs (export initiate, Slack post) are not idempotent and are only re-sent on 429:
+# see the Slack mount below and _post_export_initiate.
+RETRY = Retry(total=5, backoff_factor=1.5, status_forcelist=(429, 500, 502, 503, 504),
+              allowed_methods=frozenset(["GET"]), respect_retry_after_header=True,
+              raise_on_status=False)
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=RETRY))
+# Slack webhook: only re-send a POST Slack refused outright (429). A lost response
+# (read timeout/reset) or a 5xx may come after the message is already in the channel.
+SESSION.mount("https://hooks.slack.com/", HTTPAdapter(pool_connections=1, pool_maxsize=1,
+                                                      max_retries=RETRY.new(read=0, status_forcelist=(429,),
+                                                                            allowed_methods=frozenset(["POST"]))))
+
+# (connect, read) timeouts: a stalled handshake fails fast instead of blocking for minutes
+MP_TIMEOUT    = (5, 60)
+SLACK_TIMEOUT = (5, 10)
 
-def _iso10(s):
-    return (s or "")[:10] if isinstance(s, str) else None
+CONVERSION_LOOKBACK_DAYS = int(os.getenv("CONVERSION_LOOKBACK_DAYS", "45"))
 
-def infer_conversions_from_licenses(lic_items, target: dt.date):
-    """
-    Heuristic conversion finder for day=target:
-      - license is COMMERCIAL/PAID (not evaluation)
-      - had a trial (latestEvaluationStartDate present)
-      - license row was updated on the target date (lastUpdated == target)
-    Returns a filtered subset of lic_items (raw dicts).
-    """
-    want = []
-    tgt = target.isoformat()
-    for lic in lic_items or []:
-        lt = (lic.get("licenseType") or lic.get("tier") or "").upper()
-        if lt not in ("COMMERCIAL", "PAID"):
+_USERS_RE = re.compile(r"(\d+)\s*Users?", re.I)
+# shared read-only stand-in for missing nested objects (`x.get("app") or _EMPTY`),
+# instead of allocating a fresh {} per row
+_EMPTY = MappingProxyType({})
+
+def _users_from_tier(tier):
+    """Parse the user count from a tier label like '50 Users'."""
+    m = _USERS_RE.search(tier) if isinstance(tier, str) else None
+    return int(m.group(1)) if m else None
+
+def _email_domain(email):
+    """'jane@acme.io' -> 'acme.io' (None if not an email)."""
+    if not isinstance(email, str):
+        return None
+    _, sep, rest = email.partition("@")  # one C call, no list
+    return rest if sep else None
+
+def _s(v):
+    """Stripped non-empty string, else None (cheap building block for `or` fallback chains)."""
+    if isinstance(v, str):
+        v = v.strip()
+        return v or None
+    return None
+
+def _first(*vals):
+    """First non-empty value (strings stripped; None/''/[]/{} skipped)."""
+    for v in vals:
+        if v is None:
             continue
-        if not _iso10(lic.get("latestEvaluationStartDate")):
+        if isinstance(v, str):
+            v = v.strip()
+            if v:
+                return v
             continue
-        if _iso10(lic.get("lastUpdated")) != tgt:
+        if isinstance(v, (list, dict)) and not v:
             continue
-        want.append(lic)
-    return want
+        return v
+    return None
+
+@lru_cache(maxsize=64)
+def _upper(s: str) -> str:
+    """Upper-cased label; cached since license/feedback types repeat on nearly every row."""
+    return s.upper()
+
+def _intern(s):
+    """sys.intern for str values, passthrough for None/non-str."""
+    return sys.intern(s) if type(s) is str else s
+
+def _iso10(s):
+    return (s or "")[:10] if isinstance(s, str) else None
+
+def _is_inferred_conversion(lic, tgt: str) -> bool:
+    """COMMERCIAL/PAID license that had a trial and was updated on tgt (YYYY-MM-DD)."""
+    # lastUpdated first: it rejects almost every license in the wide window
+    if _iso10(lic.get("lastUpdated")) != tgt:
+        return False
+    if not _iso10(lic.get("latestEvaluationStartDate")):
+        return False
+    return _upper(lic.get("licenseType") or lic.get("tier") or "") in ("COMMERCIAL", "PAID")
+
+def _enrichment_entry(lic) -> dict:
+    """{"customer", "contactName", "contactEmail"} for one license (technical contact first)."""
+    cd = lic.get("contactDetails") or _EMPTY
+    comp = cd.get("company") or lic.get("customer") or lic.get("cloudSiteHostname") or "—"
+
+    # prefer technical contact, then billing
+    t = cd.get("technicalContact") or _EMPTY
+    b = cd.get("billingContact") or _EMPTY
+    return {
+        "customer": comp,
+        "contactName": t.get("name") or b.get("name"),
+        "contactEmail": t.get("email") or b.get("email"),
+    }
 
-def build_entitlement_enrichment(*license_lists):
+def index_wide_licenses(lic_items, target: dt.date):
     """
-    From licenses payloads, build a dict:
-      { entitlementNumber -> {"customer": ..., "contactName": ..., "contactEmail": ...} }
-    Uses contactDetails (technical/billing) and company when available.
+    Single pass over the wide-window licenses producing what main() needs:
+      - ent_map      : { entitlementNumber -> {"customer", "contactName", "contactEmail"} }
+      - inferred_raw : raw licenses that look like a conversion on day=target:
+                       COMMERCIAL/PAID, had a trial (latestEvaluationStartDate),
+                       and were updated on the target date (lastUpdated == target)
     """
-    out = {}
-    for lst in license_lists:
-        for lic in (lst or []):
-            ent = lic.get("appEntitlementNumber") or lic.get("hostEntitlementNumber")
-            if not ent:
-                continue
-            cd = lic.get("contactDetails") or {}
-            comp = cd.get("company") or lic.get("customer") or lic.get("cloudSiteHostname") or "—"
-
-            # prefer technical contact, then billing
-            t = cd.get("technicalContact") or {}
-            b = cd.get("billingContact") or {}
-            name  = t.get("name")  or b.get("name")
-            email = t.get("email") or b.get("email")
-
-            out[ent] = {
-                "customer": comp,
-                "contactName": name,
-                "contactEmail": email,
-            }
-    return out
+    ent_map, inferred_raw = {}, []
+    tgt = target.isoformat()
+    for lic in (lic_items or []):
+        if not _app_selected(lic):
+            continue
+        ent = lic.get("appEntitlementNumber") or lic.get("hostEntitlementNumber")
+        if ent:
+            ent_map[ent] = _enrichment_entry(lic)
+        if _is_inferred_conversion(lic, tgt):
+            inferred_raw.append(lic)
+    return ent_map, inferred_raw
 
 def build_app_name_map(*payload_lists):
     """
@@ -90,26 +187,175 @@ def build_app_name_map(*payload_lists):
     m = {}
     for plist in payload_lists:
         for it in (plist or []):
-            app = it.get("app") or {}
+            app = it.get("app") or _EMPTY
             key = it.get("addonKey") or app.get("key")
             name = it.get("addonName") or app.get("name")
             if key and name:
                 m[key] = name
     return m
 
+SLACK_HEADERS = {"Content-Type": "application/json; charset=utf-8"}
+
 def slack_post(payload: dict):
     """Post to Slack unless DRY_RUN=1, in which case just log."""
     if DRY_RUN:
-        print("[DRY_RUN] Would post to Slack:\n" + payload.get("text","")[:2000])
+        blocks = payload.get("blocks")
+        text = "\n\n".join(b["text"]["text"] for b in blocks) if blocks else payload.get("text", "")
+        print("[DRY_RUN] Would post to Slack:\n" + text[:2000])
         return
-    r = requests.post(SLACK_WEBHOOK, json=payload, timeout=30)
+    r = SESSION.post(SLACK_WEBHOOK, data=_dumps(payload), headers=SLACK_HEADERS, timeout=SLACK_TIMEOUT)
     r.raise_for_status()
 
 
+MP_CACHE_DIR = os.getenv("MP_CACHE_DIR", "")
+MP_CACHE_TTL = int(os.getenv("MP_CACHE_TTL", "3600"))  # seconds a cached body is reused as-is
+REFRESH      = os.getenv("REFRESH", "0") == "1"        # ignore cached bodies (still re-populates them)
+
+def _cache_path(url: str, params: dict | None) -> str:
+    """Cache file stem for a (url, params) pair under MP_CACHE_DIR."""
+    key = json.dumps([url, params or {}], sort_keys=True)
+    return os.path.join(MP_CACHE_DIR, hashlib.sha256(key.encode()).hexdigest())
+
+def _write_atomic(path: str, data: bytes):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def _read_body(path: str) -> bytes:
+    return gzip.decompress(_read_bytes(path))
+
+def mp_get(url: str, params: dict | None = None, timeout=MP_TIMEOUT) -> bytes:
+    """
+    GET a Marketplace endpoint and return the raw body.
+    With MP_CACHE_DIR set, the last body (gzip, + ETag) is kept on disk:
+      - younger than MP_CACHE_TTL -> returned without any request (backfill re-runs)
+      - older -> revalidated with If-None-Match; a 304 Not Modified reuses it
+      - API unreachable / 429 / 5xx after retries -> the stale body is served with a warning
+    REFRESH=1 skips the first two (always a full download) but keeps the outage fallback.
+    """
+    if not MP_CACHE_DIR:
+        r = SESSION.get(url, params=params, auth=MP_AUTH, timeout=timeout)
+        r.raise_for_status()
+        return r.content
+
+    stem = _cache_path(url, params)
+    body_path, etag_path = stem + ".body.gz", stem + ".etag"
+    try:
+        age = time.time() - os.path.getmtime(body_path)
+    except OSError:
+        age = None
+    if age is not None and age < MP_CACHE_TTL and not REFRESH:
+        return _read_body(body_path)
+
+    headers = {}
+    if age is not None and not REFRESH:
+        try:
+            with open(etag_path) as f:
+                headers["If-None-Match"] = f.read().strip()
+        except OSError:
+            pass
+
+    try:
+        r = SESSION.get(url, params=params, auth=MP_AUTH, headers=headers, timeout=timeout)
+        if r.status_code == 304:
+            os.utime(body_path)  # still current: restart its TTL
+            return _read_body(body_path)
+        r.raise_for_status()
+    except requests.RequestException as e:
+        status = getattr(e.response, "status_code", None)
+        # client errors (bad auth/params) must surface; outages fall back to the last body
+        if age is None or (status is not None and status < 500 and status != 429):
+            raise
+        print(f"[WARN] {url} unavailable ({type(e).__name__}: {e}); using cached body from {int(age)}s ago")
+        return _read_body(body_path)
+
+    os.makedirs(MP_CACHE_DIR, exist_ok=True)
+    _write_atomic(body_path, gzip.compress(r.content, compresslevel=1, mtime=0))
+    etag = r.headers.get("ETag")
+    if etag:
+        _write_atomic(etag_path, etag.encode())
+    elif os.path.exists(etag_path):
+        os.remove(etag_path)
+    return r.content
+
+def mp_get_json(url: str, params: dict | None = None, timeout=MP_TIMEOUT):
+    """
+    mp_get + decode. Without MP_CACHE_DIR (the CI default) and with ijson installed,
+    the export is decoded straight off the socket, so the raw body bytes are never
+    held in memory next to the parsed tree.
+    """
+    if MP_CACHE_DIR or not ijson:
+        return _loads(mp_get(url, params, timeout))
+    with SESSION.get(url, params=params, auth=MP_AUTH, timeout=timeout, stream=True) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True  # let urllib3 undo gzip/deflate
+        # unpacking drains the parser to end of input: trailing data raises like _loads would
+        [payload] = ijson.items(r.raw, "", use_float=True)
+        return payload
+
+def post_day_once(day: dt.date, payloads: list[dict]) -> bool:
+    """
+    Post the day's Slack payload(s) via slack_post, at most once per content.
+    With MP_CACHE_DIR set, a hash of what was posted is kept as posted_{day}.hash:
+    a re-run for the same DAY with identical content (CI retry, backfill) is a no-op.
+    Returns False when skipped.
+    """
+    marker = os.path.join(MP_CACHE_DIR, f"posted_{day.isoformat()}.hash") if MP_CACHE_DIR and not DRY_RUN else None
+    digest = hashlib.blake2b(b"\n".join(_dumps(p) for p in payloads), digest_size=16).hexdigest()
+    if marker:
+        try:
+            if _read_bytes(marker).decode() == digest:
+                print(f"[INFO] Same message for {day} was already posted; skipping.")
+                return False
+        except OSError:
+            pass
+    for p in payloads:
+        slack_post(p)
+    if marker:
+        os.makedirs(MP_CACHE_DIR, exist_ok=True)
+        _write_atomic(marker, digest.encode())
+    return True
+
 APPS_FILTER   = set([a.strip() for a in os.getenv("APPS","").split(",") if a.strip()])
 
-# Date window (UTC)
-today_utc = dt.datetime.utcnow().date()
+def _app_in_filter(item) -> bool:
+    """APPS filter on a raw payload item (addon name or key)."""
+    app = item.get("app") or _EMPTY
+    return any(v in APPS_FILTER for v in (
+        item.get("addonName"), app.get("name"), item.get("appName"),
+        item.get("addonKey"), app.get("key"),
+    ))
+
+def _select_all(item) -> bool:
+    return True
+
+# Picked once: with APPS unset (the common case) the per-row check does no dict work at all
+_app_selected = _app_in_filter if APPS_FILTER else _select_all
+
+def _retry_after_seconds(value):
+    """Retry-After header in seconds (delta form only), else None."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+def _post_export_initiate(url: str, params: dict):
+    """
+    POST an async export initiate. Only a 429 is re-sent (the request was refused,
+    nothing started); a 5xx may already have created an export server-side.
+    """
+    r = SESSION.post(url, params=params, auth=MP_AUTH, timeout=MP_TIMEOUT)
+    for attempt in range(RETRY.total):
+        if r.status_code != 429:
+            break
+        time.sleep(_retry_after_seconds(r.headers.get("Retry-After")) or RETRY.backoff_factor * 2 ** attempt)
+        r = SESSION.post(url, params=params, auth=MP_AUTH, timeout=MP_TIMEOUT)
+    return r
 
 def fetch_transactions(vendor_id: str, start: dt.date, end: dt.date):
     """
@@ -119,7 +365,7 @@ def fetch_transactions(vendor_id: str, start: dt.date, end: dt.date):
       3) download JSON
     Returns a list of transaction dicts (or []).
     """
-    import time, urllib.parse
+    import urllib.parse
 
     base = "https://marketplace.atlassian.com"
     # Try v2 then v4 (tenants differ)
@@ -134,29 +380,27 @@ def fetch_transactions(vendor_id: str, start: dt.date, end: dt.date):
         # UI often adds this; harmless if ignored:
         "include": "zeroTransactions",
     }
-    headers = {"Accept": "application/json"}
-
     status_url = None
     last_err = None
 
     # 1) Initiate
     for init in init_urls:
         try:
-            r = requests.post(init, params=qparams, headers=headers,
-                              auth=(MP_USER, MP_API_TOKEN), timeout=60)
+            r = _post_export_initiate(init, qparams)
             if r.status_code == 404:
                 last_err = f"404 on {r.url}"
                 continue
             r.raise_for_status()
-            data = r.json() if r.content else {}
+            data = _loads(r.content) if r.content else {}
+            links = data.get("links") or _EMPTY
             export_id = (
                 data.get("exportId")
                 or data.get("id")
-                or (data.get("links") or {}).get("self", "").split("/")[-1]
+                or links.get("self", "").split("/")[-1]
             )
             status_url = (
                 data.get("statusUrl")
-                or (data.get("links") or {}).get("status")
+                or links.get("status")
                 or (f"{init}/{urllib.parse.quote(str(export_id))}/status" if export_id else None)
             )
             if status_url:
@@ -170,38 +414,48 @@ def fetch_transactions(vendor_id: str, start: dt.date, end: dt.date):
         print(f"[WARN] transactions initiate failed: {last_err}")
         return []
 
-    # 2) Poll status (up to ~60s)
-    deadline = time.time() + 60
+    # 2) Poll status (up to ~180s): 1s, 2s, 4s, then every 8s; a Retry-After hint wins.
+    #    If the status endpoint sends an ETag, revalidate with it: 304 = state unchanged.
+    deadline = time.time() + 180
     download_url = None
+    delay = 1.0
+    status_hdrs = {}
     while time.time() < deadline:
-        rs = requests.get(status_url, headers=headers, auth=(MP_USER, MP_API_TOKEN), timeout=60)
-        if rs.status_code == 404:
-            time.sleep(2)
-            continue
-        rs.raise_for_status()
-        sdata = rs.json() if rs.content else {}
-        state = (sdata.get("state") or sdata.get("status") or "").lower()
-        download_url = sdata.get("downloadUrl") or sdata.get("resultUrl")
-        if state in ("completed", "complete", "done") and download_url:
-            break
-        if state in ("failed", "error"):
-            print(f"[WARN] transactions export failed: {sdata}")
-            return []
-        time.sleep(2)
+        rs = SESSION.get(status_url, auth=MP_AUTH, headers=status_hdrs, timeout=MP_TIMEOUT)
+        if rs.status_code not in (304, 404):  # 404: export not registered yet, keep polling
+            rs.raise_for_status()
+            etag = rs.headers.get("ETag")
+            status_hdrs = {"If-None-Match": etag} if etag else {}
+            sdata = _loads(rs.content) if rs.content else {}
+            state = (sdata.get("state") or sdata.get("status") or "").lower()
+            download_url = sdata.get("downloadUrl") or sdata.get("resultUrl")
+            if state in ("completed", "complete", "done") and download_url:
+                break
+            if state in ("failed", "error"):
+                print(f"[WARN] transactions export failed: {sdata}")
+                return []
+        wait = _retry_after_seconds(rs.headers.get("Retry-After")) or delay
+        time.sleep(max(0.0, min(wait, deadline - time.time())))  # never sleep past the deadline
+        delay = min(delay * 2, 8.0)
 
     if not download_url:
         print("[WARN] transactions export timed out without downloadUrl")
         return []
 
-    # 3) Download JSON
-    rd = requests.get(download_url, headers=headers, auth=(MP_USER, MP_API_TOKEN), timeout=120)
-    rd.raise_for_status()
+    # 3) Download JSON (raw bytes go straight to the parser; the response is
+    #    released right away so only the parsed list stays alive)
+    if ijson:
+        return _stream_transactions(download_url)
+    with SESSION.get(download_url, auth=MP_AUTH, timeout=MP_TIMEOUT) as rd:
+        rd.raise_for_status()
+        body = rd.content
     try:
-        payload = rd.json()
+        payload = _loads(body)
     except Exception:
         print("[WARN] transactions export is not JSON; first 200 chars:")
-        print(rd.text[:200])
+        print(body[:200].decode("utf-8", "replace"))
         return []
+    del body
 
     # Normalize list
     if isinstance(payload, list):
@@ -210,29 +464,44 @@ def fetch_transactions(vendor_id: str, start: dt.date, end: dt.date):
         return payload["transactions"]
     return []
 
-def debug_dump_transactions(items, prefix="[TX]"):
-    def first(*vals):
-        for v in vals:
-            if isinstance(v, str) and v.strip():
-                return v.strip()
-            if v not in (None, "", [], {}):
-                return v
-        return None
+def _stream_transactions(download_url: str):
+    """
+    ijson variant of the download step: records are parsed straight off the socket,
+    so the export body is never held in memory as a whole.
+    Accepts both a bare list and {"transactions": [...]}.
+    """
+    with SESSION.get(download_url, auth=MP_AUTH, timeout=MP_TIMEOUT, stream=True) as rd:
+        rd.raise_for_status()
+        rd.raw.decode_content = True  # let urllib3 undo gzip/deflate
+        try:
+            [payload] = ijson.items(rd.raw, "", use_float=True)  # trailing data raises too
+        except (ijson.JSONError, ValueError) as e:
+            print(f"[WARN] transactions export is not valid JSON: {e}")
+            return []
 
-    print(f"{prefix} total: {len(items)}")
+    # Normalize list
+    if isinstance(payload, list):
+        return payload
+    if isinstance(payload, dict) and isinstance(payload.get("transactions"), list):
+        return payload["transactions"]
+    return []
+
+def debug_dump_transactions(items, prefix="[TX]"):
+    lines = [f"{prefix} total: {len(items)}"]
     for i, t in enumerate(items[:50], 1):
-        when = first(t.get("transactionDate"), t.get("date"), t.get("created"))
+        when = _first(t.get("transactionDate"), t.get("date"), t.get("created"))
         if isinstance(when, str): when = when[:19]
-        ent  = first(t.get("appEntitlementNumber"), t.get("entitlementNumber"))
-        typ  = (first(t.get("transactionType"), t.get("eventType"), t.get("type")) or "").upper()
-        lic  = (first(t.get("licenseType"), t.get("license")) or "").title()
-        app  = first(t.get("addonName"), (t.get("app") or {}).get("name"), "Unknown app")
-        cust = first((t.get("contactDetails") or {}).get("company"), t.get("customer"), t.get("accountName"), "—")
-        users= first(t.get("users"), t.get("quantity"), t.get("seats"))
-        amt  = first(t.get("amount"), t.get("price")); cur = first(t.get("currency"), t.get("currencyCode"))
+        ent  = _first(t.get("appEntitlementNumber"), t.get("entitlementNumber"))
+        typ  = _upper(_first(t.get("transactionType"), t.get("eventType"), t.get("type")) or "")
+        lic  = (_first(t.get("licenseType"), t.get("license")) or "").title()
+        app  = _first(t.get("addonName"), (t.get("app") or _EMPTY).get("name"), "Unknown app")
+        cust = _first((t.get("contactDetails") or _EMPTY).get("company"), t.get("customer"), t.get("accountName"), "—")
+        users= _first(t.get("users"), t.get("quantity"), t.get("seats"))
+        amt  = _first(t.get("amount"), t.get("price")); cur = _first(t.get("currency"), t.get("currencyCode"))
         amt_s = f" · {amt} {cur}" if amt and cur else ""
         users_s = f" · {users} users" if users else ""
-        print(f"{prefix} {i:02d} • {when} • {app} • {typ}/{lic}{users_s} • {cust} • {ent}{amt_s}")
+        lines.append(f"{prefix} {i:02d} • {when} • {app} • {typ}/{lic}{users_s} • {cust} • {ent}{amt_s}")
+    sys.stdout.write("\n".join(lines) + "\n")  # one write instead of a print per line
 
 
 def fetch_cloud_conversions(vendor_id: str, start: dt.date, end: dt.date):
@@ -251,25 +520,21 @@ def fetch_cloud_conversions(vendor_id: str, start: dt.date, end: dt.date):
         {"startDate": start.isoformat(), "endDate": end.isoformat(), "accept": "json", "include": "zeroTransactions"},
         {"startDate": start.isoformat(), "endDate": end.isoformat(), "accept": "json"},
     ]
-    headers = {"Accept": "application/json"}
     last_err = None
 
     for url in endpoints:
         for params in param_variants:
             try:
-                r = requests.get(url, params=params, headers=headers,
-                                 auth=(MP_USER, MP_API_TOKEN), timeout=60)
-                # Some tenants return 404 on one variant but not the other
-                if r.status_code == 404:
-                    last_err = f"404 on {r.url}"
-                    continue
+                # via mp_get: a re-run for the same DAY is served from MP_CACHE_DIR,
+                # and an outage falls back to the last body.
+                # Some tenants return 404 on one variant but not the other (raised -> next variant)
+                body = mp_get(url, params)
                 # 204/empty bodies → keep trying next variant
-                if r.status_code == 204 or not r.content:
-                    last_err = f"{r.status_code} no content on {r.url}"
+                if not body:
+                    last_err = f"no content on {url}"
                     continue
 
-                r.raise_for_status()
-                data = r.json()
+                data = _loads(body)
                 # API sometimes returns a list or {"transactions":[...]}
                 if isinstance(data, list):
                     return data
@@ -278,7 +543,7 @@ def fetch_cloud_conversions(vendor_id: str, start: dt.date, end: dt.date):
                     if isinstance(items, list):
                         return items
                 # fall through to try next variant
-                last_err = f"unexpected JSON on {r.url}"
+                last_err = f"unexpected JSON on {url}"
             except Exception as e:
                 last_err = f"{type(e).__name__}: {e} on {url}"
                 continue
@@ -290,73 +555,97 @@ def debug_dump_conversions(items, prefix="[CONV]"):
     """
     Print compact lines for cloud conversions so you can see what the API returns.
     """
-    def first(*vals):
-        for v in vals:
-            if isinstance(v, str) and v.strip():
-                return v.strip()
-            if v not in (None, "", [], {}):
-                return v
-        return None
-
-    print(f"{prefix} total: {len(items)}")
+    lines = [f"{prefix} total: {len(items)}"]
     for i, c in enumerate(items[:100], 1):
-        when = first(c.get("conversionDate"), c.get("date"))
+        when = _first(c.get("conversionDate"), c.get("date"))
         if isinstance(when, str):
             when = when[:19]
-        ent  = first(c.get("appEntitlementNumber"), c.get("entitlementNumber"))
-        app  = first(c.get("addonName"), (c.get("app") or {}).get("name"), "Unknown app")
-        key  = first(c.get("addonKey"), (c.get("app") or {}).get("key"))
-        cust = first((c.get("contactDetails") or {}).get("company"),
-                     c.get("customer"), c.get("accountName"),
-                     c.get("cloudSiteHostname"), "—")
-        users = first(c.get("users"), c.get("seats"), c.get("quantity"))
+        ent  = _first(c.get("appEntitlementNumber"), c.get("entitlementNumber"))
+        capp = c.get("app") or _EMPTY
+        app  = _first(c.get("addonName"), capp.get("name"), "Unknown app")
+        key  = _first(c.get("addonKey"), capp.get("key"))
+        cust = _first((c.get("contactDetails") or _EMPTY).get("company"),
+                      c.get("customer"), c.get("accountName"),
+                      c.get("cloudSiteHostname"), "—")
+        users = _first(c.get("users"), c.get("seats"), c.get("quantity"))
         users_s = f" · {users} users" if users else ""
-        print(f"{prefix} {i:02d} • {when} • {app} • {cust} • {ent}{users_s} • key={key}")
+        lines.append(f"{prefix} {i:02d} • {when} • {app} • {cust} • {ent}{users_s} • key={key}")
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
+_LICENSE_ID_KEYS = ("appEntitlementNumber", "hostEntitlementNumber", "appEntitlementId", "hostEntitlementId")
+
 def _extract_license_id(lic: dict):
     """Prefer the visible E-… entitlement; fall back to other ids/composite."""
-    def _first(*vals):
-        for v in vals:
-            if isinstance(v, str) and v.strip():
-                return v.strip()
-            if v not in (None, "", [], {}):
-                return v
-        return None
-    return _first(
-        lic.get("appEntitlementNumber"),
-        lic.get("hostEntitlementNumber"),
-        lic.get("appEntitlementId"),
-        lic.get("hostEntitlementId"),
-        (f"{lic.get('addonKey')}::{lic.get('cloudId')}"
-         if lic.get("addonKey") and lic.get("cloudId") else None),
-    )
-
-CONVERSION_LOOKBACK_DAYS = int(os.getenv("CONVERSION_LOOKBACK_DAYS", "45"))
+    ent = lic.get("appEntitlementNumber")
+    # fast path (nearly every row): skip evaluating the fallbacks below
+    if type(ent) is str and (ent := ent.strip()):
+        return ent
+    # otherwise stop at the first usable id; the composite is only built as a last resort
+    for k in _LICENSE_ID_KEYS:
+        v = _first(lic.get(k))
+        if v is not None:
+            return v
+    addon_key, cloud_id = lic.get("addonKey"), lic.get("cloudId")
+    return f"{addon_key}::{cloud_id}" if addon_key and cloud_id else None
 
 def _parse_date(s: str | None):
-    if not s:
+    if not s or not isinstance(s, str):  # ints/other JSON types are bad input too
         return None
+    return _parse_day(s[:10])
+
+@lru_cache(maxsize=4096)
+def _parse_day(d: str):
+    """YYYY-MM-DD -> date (None if malformed); cached since rows share a few hundred distinct days."""
     try:
-        return dt.date.fromisoformat(s[:10])
+        if ciso8601:
+            return ciso8601.parse_datetime_as_naive(d).date()
+        return dt.date.fromisoformat(d)
     except Exception:
         return None
 
-def day_window_utc():
+def day_window_utc(today: dt.date):
     """
     Returns (start_date, end_date) as the same YYYY-MM-DD date in UTC.
-    If env DAY=YYYY-MM-DD is set, uses that date; else defaults to yesterday (UTC).
+    If env DAY=YYYY-MM-DD is set, uses that date; else defaults to yesterday (UTC),
+    relative to `today` (UTC).
     """
     d = os.getenv("DAY")
     if d:
         s = e = dt.date.fromisoformat(d)
     else:
-        e = dt.datetime.utcnow().date() - dt.timedelta(days=1)
+        e = today - dt.timedelta(days=1)
         s = e
     return s, e
 
-# Pick the reporting day (yesterday by default, or DAY=YYYY-MM-DD for backfill)
-start_date, end_date = day_window_utc()
+_LIST_KEYS    = ("licenses", "items", "data", "results", "values")
+_WRAPPER_KEYS = ("content", "page", "paging", "_embedded")
+_SINGLE_KEYS  = ("licenseId", "appName", "customer", "evaluationStartDate")
+
+def _extract_items(p):
+    """Pull the license list out of an export payload (bare array or object wrapper)."""
+    # If the API returns a bare array (the common case)
+    if type(p) is list:
+        return p
+    if type(p) is not dict:
+        return []
+    # If it returns an object wrapper
+    for key in _LIST_KEYS:
+        v = p.get(key)
+        if type(v) is list:
+            return v
+    # nested containers some responses use
+    for key in _WRAPPER_KEYS:
+        w = p.get(key)
+        if type(w) is dict:
+            for k2 in _LIST_KEYS:
+                v = w.get(k2)
+                if type(v) is list:
+                    return v
+    # single-record fallback
+    if any(k in p for k in _SINGLE_KEYS):
+        return [p]
+    return []
 
 def fetch_licenses(vendor_id: str, start: dt.date, end: dt.date):
     """
@@ -372,37 +661,7 @@ def fetch_licenses(vendor_id: str, start: dt.date, end: dt.date):
         "accept": "json",           # export API returns JSON when accept=json
         "withDataInsights": "true", # include evaluation/customer fields
     }
-    auth = (MP_USER, MP_API_TOKEN)
-    headers = {"Accept": "application/json"}
-
-    r = requests.get(url, params=params, auth=auth, headers=headers, timeout=120)
-    r.raise_for_status()
-    payload = r.json()
-
-    def extract_items(p):
-        # If the API returns a bare array
-        if isinstance(p, list):
-            return p
-        # If it returns an object wrapper
-        if isinstance(p, dict):
-            for key in ("licenses", "items", "data", "results", "values"):
-                v = p.get(key)
-                if isinstance(v, list):
-                    return v
-            # nested containers some responses use
-            for key in ("content", "page", "paging", "_embedded"):
-                v = p.get(key)
-                if isinstance(v, dict):
-                    for k2 in ("licenses", "items", "data", "results", "values"):
-                        v2 = v.get(k2)
-                        if isinstance(v2, list):
-                            return v2
-            # single-record fallback
-            if any(k in p for k in ("licenseId", "appName", "customer", "evaluationStartDate")):
-                return [p]
-        return []
-
-    return extract_items(payload)
+    return _extract_items(mp_get_json(url, params))
 
 def pick_new_evaluations(items, date_from: dt.date, date_to: dt.date):
     """
@@ -414,61 +673,52 @@ def pick_new_evaluations(items, date_from: dt.date, date_to: dt.date):
       - licenseType : e.g., EVALUATION/COMMERCIAL (uppercased)
       - users    : parsed from 'tier' when present
       - licenseId: visible entitlement number if available
+    Yields rows lazily so callers can filter without building a full list first.
     """
-    import re
-
-    def first(*vals):
-        for v in vals:
-            if isinstance(v, str) and v.strip():
-                return v.strip()
-            if v not in (None, "", [], {}):
-                return v
-        return None
-
-    def domain(email):
-        return email.split("@", 1)[1] if isinstance(email, str) and "@" in email else None
-
-    rows = []
     for lic in (items or []):
-        # Names/keys
-        app_name = first(
-            lic.get("addonName"),
-            (lic.get("app") or {}).get("name"),
-            lic.get("appName"),
-            "Unknown app",
-        )
-        # compute the key inline (no temporary variable)
-        app_key_expr = first(
-            lic.get("addonKey"),
-            (lic.get("app") or {}).get("key"),
-            app_name,  # last-resort fallback to keep grouping stable
+        if not _app_selected(lic):
+            continue
+        get = lic.get  # bound once: ~15 lookups per row
+        # Names/keys (short-circuit: later candidates are only looked up when needed)
+        app = get("app") or _EMPTY
+        app_name = sys.intern(
+            _s(get("addonName"))
+            or _s(app.get("name"))
+            or _s(get("appName"))
+            or "Unknown app"
         )
+        app_key = sys.intern(
+            _s(get("addonKey"))
+            or _s(app.get("key"))
+            or app_name  # last-resort fallback to keep grouping stable
+        )  # interned: a handful of keys repeated on every row and used as group keys
 
         # Contact/customer
-        cd   = lic.get("contactDetails") or {}
-        tech = cd.get("technicalContact") or {}
-        bill = cd.get("billingContact") or {}
-        site = lic.get("cloudSiteHostname")
-
-        customer = first(
-            cd.get("company"),
-            site,
-            domain(tech.get("email")),
-            domain(bill.get("email")),
-            tech.get("name"),
-            bill.get("name"),
-            "Unknown customer",
+        cd   = get("contactDetails") or _EMPTY
+        tech = cd.get("technicalContact") or _EMPTY
+        bill = cd.get("billingContact") or _EMPTY
+        tech_name,  bill_name  = _s(tech.get("name")),  _s(bill.get("name"))
+        tech_email, bill_email = _s(tech.get("email")), _s(bill.get("email"))
+
+        customer = (
+            _s(cd.get("company"))
+            or _s(get("cloudSiteHostname"))
+            or _email_domain(tech_email)
+            or _email_domain(bill_email)
+            or tech_name
+            or bill_name
+            or "Unknown customer"
         )
-        contact_name  = first(tech.get("name"),  bill.get("name"))
-        contact_email = first(tech.get("email"), bill.get("email"))
+        contact_name  = tech_name or bill_name
+        contact_email = tech_email or bill_email
 
         # Type & users
         license_id = _extract_license_id(lic)
-        license_type = (lic.get("licenseType") or lic.get("tier") or "LICENSE").upper()
+        license_type = _upper(get("licenseType") or get("tier") or "LICENSE")
 
         # Evaluation insights: potential number of users for trials
         trial_user_count = None
-        raw_eval_size = lic.get("evaluationOpportunitySize")
+        raw_eval_size = get("evaluationOpportunitySize")
         if isinstance(raw_eval_size, str):
             if raw_eval_size.isdigit():
                 trial_user_count = int(raw_eval_size)
@@ -478,53 +728,36 @@ def pick_new_evaluations(items, date_from: dt.date, date_to: dt.date):
             except (TypeError, ValueError):
                 trial_user_count = None
 
-        users = None
-        if isinstance(lic.get("tier"), str):
-            m = re.search(r"(\d+)\s*Users?", lic["tier"], re.I)
-            if m:
-                users = int(m.group(1))
-
-
-        # Best visible ID
-        license_id = first(
-            lic.get("appEntitlementNumber"),
-            lic.get("hostEntitlementNumber"),
-            lic.get("appEntitlementId"),
-            lic.get("hostEntitlementId"),
-            (f"{lic.get('addonKey')}::{lic.get('cloudId')}"
-             if lic.get("addonKey") and lic.get("cloudId") else None),
-        )
+        users = _users_from_tier(get("tier"))
 
-        start_dt = _parse_date(
-            lic.get("maintenanceStartDate")
-            or lic.get("latestMaintenanceStartDate")
-            or lic.get("evaluationStartDate")
-        )
-        trial_dt = _parse_date(lic.get("latestEvaluationStartDate"))
-        
+        # Conversion window: dates are only parsed for paid licenses that had a trial
+        trial_iso = _iso10(get("latestEvaluationStartDate")) or None
         is_paid = license_type not in ("EVALUATION", "EVAL", "TRIAL")
-        is_conversion = (
-            is_paid and trial_dt and start_dt and
-            (start_dt - trial_dt).days >= 0 and
-            (start_dt - trial_dt).days <= CONVERSION_LOOKBACK_DAYS
-        )
+        is_conversion = False
+        if is_paid and trial_iso:
+            start_dt = _parse_date(
+                get("maintenanceStartDate")
+                or get("latestMaintenanceStartDate")
+                or get("evaluationStartDate")
+            )
+            trial_dt = _parse_date(trial_iso)
+            if start_dt and trial_dt:
+                is_conversion = 0 <= (start_dt - trial_dt).days <= CONVERSION_LOOKBACK_DAYS
 
-        rows.append({
+        yield {
             "app": app_name,
-            "appKey": app_key_expr,
+            "appKey": app_key,
             "customer": customer,
             "contactName": contact_name,
             "contactEmail": contact_email,
+            "contact": contact_label(contact_name, contact_email),
             "licenseType": license_type,
             "users": users,
             "licenseId": license_id,
-            "isConversion": bool(is_conversion),
-            "trialStarted": trial_dt.isoformat() if trial_dt else None,
+            "isConversion": is_conversion,
+            "trialStarted": trial_iso,
             "trial_user_count": trial_user_count if license_type in ("EVALUATION", "EVAL", "TRIAL") else None,
-
-        })
-
-    return rows
+        }
 
 def fetch_uninstalls(vendor_id: str, start: dt.date, end: dt.date):
     """
@@ -540,17 +773,20 @@ def fetch_uninstalls(vendor_id: str, start: dt.date, end: dt.date):
         # churn actions to include:
         "type": ["uninstall", "unsubscribe", "disable"],
     }
-    auth = (MP_USER, MP_API_TOKEN)
-    headers = {"Accept": "application/json"}
-    r = requests.get(url, params=params, auth=auth, headers=headers, timeout=120)
-    r.raise_for_status()
-    data = r.json()
+    data = mp_get_json(url, params)
     if isinstance(data, list):
         return data
     if isinstance(data, dict):
         return data.get("feedback", []) or data.get("items", []) or []
     return []
 
+# human labels for feedback types (optional)
+ACTION_LABELS = {
+    "UNSUBSCRIBE": "UNSUBSCRIBE",
+    "UNINSTALL": "UNINSTALL",
+    "DISABLE": "DISABLE",
+}
+
 def pick_uninstalls(items, name_map=None, ent_map=None):
     """
     Map Feedback/Uninstall/Unsubscribe rows to the common row shape,
@@ -558,16 +794,19 @@ def pick_uninstalls(items, name_map=None, ent_map=None):
     """
     out = []
     for f in (items or []):
-        app = f.get("app") or {}
-        app_name = f.get("addonName") or app.get("name")
-        app_key  = f.get("addonKey")  or app.get("key")
+        if not _app_selected(f):
+            continue
+        get = f.get
+        app = get("app") or _EMPTY
+        app_name = get("addonName") or app.get("name")
+        app_key  = get("addonKey")  or app.get("key")
 
         # raw fields from feedback payload
-        cust   = (f.get("contactDetails") or {}).get("company") or f.get("customer") or "Unknown"
-        name   = f.get("contactName")
-        email  = f.get("contactEmail")
-        ftype  = (f.get("feedbackType") or "").upper()  # UNSUBSCRIBE / UNINSTALL / DISABLE
-        ent_id = f.get("appEntitlementNumber") or f.get("entitlementNumber")
+        cust   = (get("contactDetails") or _EMPTY).get("company") or get("customer") or "Unknown"
+        name   = get("contactName")
+        email  = get("contactEmail")
+        ftype  = _upper(get("feedbackType") or "")  # UNSUBSCRIBE / UNINSTALL / DISABLE
+        ent_id = get("appEntitlementNumber") or get("entitlementNumber")
 
         # enrichment from licenses by entitlement number
         if ent_map and ent_id:
@@ -580,29 +819,59 @@ def pick_uninstalls(items, name_map=None, ent_map=None):
                 if not email:
                     email = info.get("contactEmail")
 
-        # human labels (optional)
-        ACTION_LABELS = {
-            "UNSUBSCRIBE": "UNSUBSCRIBE",
-            "UNINSTALL": "UNINSTALL",
-            "DISABLE": "DISABLE",
-        }
         label = ACTION_LABELS.get(ftype, ftype or "UNSUBSCRIBE")
 
         out.append({
-            "app": app_name or (name_map or {}).get(app_key) or app_key or "Unknown app",
-            "appKey": app_key or app_name,
+            "app": _intern(app_name or (name_map or _EMPTY).get(app_key) or app_key or "Unknown app"),
+            "appKey": _intern(app_key or app_name),
             "customer": cust or "—",
             "contactName": name,
             "contactEmail": email,
+            "contact": contact_label(name, email),
             "licenseType": label,
             "users": None,
             "licenseId": ent_id,
         })
     return out
 
+SLACK_MAX_BLOCKS    = 50    # blocks per message
+SLACK_SECTION_CHARS = 3000  # mrkdwn chars per section block
+
+def _section_blocks(lines) -> list[dict]:
+    """Pack mrkdwn lines into section blocks under Slack's per-section limit."""
+    blocks, cur, size = [], [], 0
+    for line in lines:
+        line = line[:SLACK_SECTION_CHARS - 1]
+        if cur and size + len(line) + 1 > SLACK_SECTION_CHARS:
+            blocks.append("\n".join(cur))
+            cur, size = [], 0
+        cur.append(line)
+        size += len(line) + 1
+    if cur:
+        blocks.append("\n".join(cur))
+    return [{"type": "section", "text": {"type": "mrkdwn", "text": b}} for b in blocks if b.strip()]
+
+def contact_label(name, email):
+    """'Name (email)' when both are known, else whichever is present, else '—'."""
+    if name and email:
+        return f"{name} ({email})"
+    return name or email or "—"
+
+def prettiest_name(names: set[str]) -> str:
+    if not names:
+        return "Unknown app"
+    # prefer human-looking names (with spaces/colon)
+    return min(names, key=lambda s: (":" not in s and " " not in s, len(s)))
+
+def _row_line(e: dict, users=None, tail: str = "") -> str:
+    """'• customer · contact · TYPE [· N users] [· E-...]{tail}', built as one f-string."""
+    lid = e.get("licenseId")
+    return (f"• {e['customer']} · {e.get('contact') or contact_label(e.get('contactName'), e.get('contactEmail'))}"
+            f" · {e['licenseType']}{f' · {users} users' if users else ''}{f' · {lid}' if lid else ''}{tail}")
+
 def post_combined_to_slack(webhook, licenses_rows, uninstall_rows, start: dt.date, end: dt.date):
     """
-    One message per appKey:
+    One Slack message (Block Kit), one section per appKey:
       {Pretty App Name} Marketplace Events (YYYY-MM-DD, UTC)
 
     ✈️ New licenses
@@ -611,156 +880,127 @@ def post_combined_to_slack(webhook, licenses_rows, uninstall_rows, start: dt.dat
     ➖ Uninstalls / Unsubscribes
     • customer/site · Name (email) · TYPE [· E-...]
     """
-    # Group by canonical key
-    groups = {}
-    for r in (licenses_rows or []):
-        k = r.get("appKey") or r.get("app") or "unknown"
-        g = groups.setdefault(k, {"names": set(), "lic": [], "un": []})
-        if r.get("app"):
-            g["names"].add(r["app"])
-        g["lic"].append(r)
-
-    for r in (uninstall_rows or []):
-        k = r.get("appKey") or r.get("app") or "unknown"
-        g = groups.setdefault(k, {"names": set(), "lic": [], "un": []})
-        if r.get("app"):
-            g["names"].add(r["app"])
-        g["un"].append(r)
+    # Group by canonical key (single pass over both row kinds)
+    groups = defaultdict(lambda: {"names": set(), "lic": [], "un": []})
+    for rows, bucket in ((licenses_rows or [], "lic"), (uninstall_rows or [], "un")):
+        for r in rows:
+            app = r.get("app")
+            g = groups[r.get("appKey") or app or "unknown"]
+            if app:
+                g["names"].add(app)
+            g[bucket].append(r)
 
     if not groups:
-        slack_post({"text": f"ℹ️ No new licenses or uninstalls for {start.isoformat()} (UTC)."})
-        print("Nothing to post.")
+        if post_day_once(start, [{"text": f"ℹ️ No new licenses or uninstalls for {start.isoformat()} (UTC)."}]):
+            print("[INFO] No items; posted 'no changes' message to Slack.")
         return
 
-    def prettiest_name(names: set[str]) -> str:
-        if not names:
-            return "Unknown app"
-        # prefer human-looking names (with spaces/colon)
-        return sorted(names, key=lambda s: (":" not in s and " " not in s, len(s)))[0]
-
     date_label = start.isoformat()
-    parts: list[str] = []
-    
-    for k in sorted(groups.keys()):
+    # one list of mrkdwn lines per app (-> its own section block(s)); lines go straight
+    # into the blocks, no join-then-split of an intermediate message string
+    blocks: list[dict] = []
+
+    for k in sorted(groups):
         g = groups[k]
-        app_title = prettiest_name(g["names"])
-    
-        section_chunks: list[str] = []
-    
+        out = [f"{prettiest_name(g['names'])} Marketplace Events ({date_label}, UTC)"]
+
         # app-scoped rows
-        lic_rows = g["lic"]
-        un_rows  = g["un"]
-    
-        # 1) split licenses into conversions vs non-conversions
-        paid_conversions = [e for e in lic_rows if e.get("isConversion")]
-        new_nonconversion = [e for e in lic_rows if not e.get("isConversion")]
-    
-        # (optional) same-day reinstall marker
-        reinstalled_ids = {e["licenseId"] for e in lic_rows if e.get("licenseId")}
-    
+        un_rows = g["un"]
+
+        # 1) split licenses into conversions vs non-conversions (one pass), collecting
+        #    this app's license ids for the same-day reinstall marker on the way
+        paid_conversions, new_nonconversion = [], []
+        reinstalled_ids = set()
+        for e in g["lic"]:
+            (paid_conversions if e.get("isConversion") else new_nonconversion).append(e)
+            if e.get("licenseId"):
+                reinstalled_ids.add(e["licenseId"])
+
         # Conversions
         if paid_conversions:
-            lines = []
+            out += ("", ":moneybag: Conversions (trial → paid)")
             for e in paid_conversions:
-                contact = (
-                    f"{e['contactName']} ({e['contactEmail']})"
-                    if e.get("contactName") and e.get("contactEmail")
-                    else (e.get("contactName") or e.get("contactEmail") or "—")
-                )
-                users_part = f" · {e['users']} users" if e.get("users") else ""
-                id_part    = f" · {e['licenseId']}" if e.get("licenseId") else ""
-                trial_part = f" (trial started {e['trialStarted']})" if e.get("trialStarted") else ""
-                lines.append(f"• {e['customer']} · {contact} · {e['licenseType']}{users_part}{id_part}{trial_part}")
-            section_chunks.append(":moneybag: Conversions (trial → paid)\n" + "\n".join(lines))
-    
+                trial = e.get("trialStarted")
+                out.append(_row_line(e, e.get("users"), f" (trial started {trial})" if trial else ""))
+
         # New licenses (non-conversions)
         if new_nonconversion:
-            lines = []
+            out += ("", ":airplane: New licenses")
             for e in new_nonconversion:
-                contact = (
-                    f"{e['contactName']} ({e['contactEmail']})"
-                    if e.get("contactName") and e.get("contactEmail")
-                    else (e.get("contactName") or e.get("contactEmail") or "—")
-                )
                 trial_users = e.get("trial_user_count")
-                if trial_users and e.get("licenseType") in ("EVALUATION", "EVAL", "TRIAL"):
-                    # For trials: show "10 users" based on evaluationOpportunitySize
-                    users_part = f" · {trial_users} users"
-                else:
-                    # For paid licenses: keep existing users count from tier
-                    users_part = f" · {e['users']} users" if e.get("users") else ""
-                id_part    = f" · {e['licenseId']}" if e.get("licenseId") else ""
-                lines.append(f"• {e['customer']} · {contact} · {e['licenseType']}{users_part}{id_part}")
-            section_chunks.append(":airplane: New licenses\n" + "\n".join(lines))
+                # For trials: show "10 users" based on evaluationOpportunitySize;
+                # for paid licenses: keep existing users count from tier
+                trial = trial_users and e.get("licenseType") in ("EVALUATION", "EVAL", "TRIAL")
+                out.append(_row_line(e, trial_users if trial else e.get("users")))
 
-    
-        # Uninstalls / Unsubscribes (keep your existing loop, but you can add same-day reinstall flag)
+        # Uninstalls / Unsubscribes (with same-day reinstall flag)
         if un_rows:
-            lines = []
+            out += ("", ":heavy_minus_sign: Uninstalls / Unsubscribes")
             for e in un_rows:
-                contact = (
-                    f"{e['contactName']} ({e['contactEmail']})"
-                    if e.get("contactName") and e.get("contactEmail")
-                    else (e.get("contactName") or e.get("contactEmail") or "—")
-                )
-                id_part = f" · {e['licenseId']}" if e.get("licenseId") else ""
-                reinst_part = " (same-day reinstall)" if e.get("licenseId") in reinstalled_ids else ""
-                lines.append(f"• {e['customer']} · {contact} · {e['licenseType']}{id_part}{reinst_part}")
-            section_chunks.append(":heavy_minus_sign: Uninstalls / Unsubscribes\n" + "\n".join(lines))
-
-    parts.append(f"{app_title} Marketplace Events ({date_label}, UTC)\n\n" + "\n\n".join(section_chunks))
-
-    text = "\n\n".join(parts)
-    slack_post({"text": text})
-    print("Posted combined message (merged by appKey).")
+                out.append(_row_line(e, None, " (same-day reinstall)" if e.get("licenseId") in reinstalled_ids else ""))
+
+        blocks += _section_blocks(out)
+
+    # All apps go out in a single request; only past Slack's 50-block cap is it split.
+    fallback = f"Marketplace events for {date_label} (UTC)"  # notification/preview text
+    payloads = [{"text": fallback, "blocks": blocks[i:i + SLACK_MAX_BLOCKS]}
+                for i in range(0, len(blocks), SLACK_MAX_BLOCKS)]
+    if post_day_once(start, payloads):
+        print("Posted combined message (merged by appKey).")
 
 def main():
-    start_date, end_date = day_window_utc()
+    # Pick the reporting day (yesterday by default, or DAY=YYYY-MM-DD for backfill);
+    # the clock is read once per run, here, with an aware clock (utcnow() is deprecated)
+    today_utc = dt.datetime.now(dt.timezone.utc).date()
+    start_date, end_date = day_window_utc(today_utc)
     print(f"[INFO] Daily window (UTC): {start_date}")
 
-    # 2a) Wide fetch for conversion inference (uses lastUpdated on the target date)
+    # Today (or a future DAY) isn't finalized in the exports yet: nothing to fetch
+    if start_date >= today_utc:
+        print(f"[INFO] {start_date} is not finalized yet (today UTC is {today_utc}); skipping.")
+        return
+
+    # 1) The three exports are independent round-trips to the same host:
+    #    fetch them concurrently over the pooled SESSION (wall time ~ the slowest one)
     wide_start = start_date - dt.timedelta(days=CONVERSION_LOOKBACK_DAYS)
-    lic_items_wide = fetch_licenses(VENDOR_ID, wide_start, end_date)   # existing function
-    # build entitlement -> customer/contact enrichment
-    ent_map = build_entitlement_enrichment(lic_items_wide)
-
-    inferred_raw = infer_conversions_from_licenses(lic_items_wide, start_date)
-    conv_rows = pick_new_evaluations(inferred_raw, start_date, end_date)  # reuse your mapper
-    # mark as conversions + carry trial start date if present
-    # build a quick index by licenseId so we can annotate trialStarted:
-    raw_by_ent = {}
-    for lic in inferred_raw:
-        ent = lic.get("appEntitlementNumber") or lic.get("hostEntitlementNumber")
-        if ent:
-            raw_by_ent[ent] = lic
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        f_wide = ex.submit(fetch_licenses, VENDOR_ID, wide_start, end_date)
+        f_lic  = ex.submit(fetch_licenses, VENDOR_ID, start_date, end_date)
+        f_un   = ex.submit(fetch_uninstalls, VENDOR_ID, start_date, end_date)
+        lic_items_wide, lic_items, un_items = f_wide.result(), f_lic.result(), f_un.result()
+        del f_wide, f_lic, f_un  # each Future keeps its result alive; drop them so the exports can be freed below
+
+    # 2a) Wide window for conversion inference (uses lastUpdated on the target date):
+    # one pass builds the entitlement -> customer/contact enrichment and the conversion candidates
+    ent_map, inferred_raw = index_wide_licenses(lic_items_wide, start_date)
+    # only these indexes are needed from here on;
+    # release the (largest) wide export before the row mapping below
+    del lic_items_wide
+    conv_rows = list(pick_new_evaluations(inferred_raw, start_date, end_date))  # reuse your mapper
+    # mark as conversions (trialStarted is already carried by the mapper)
     for r in conv_rows:
         r["isConversion"] = True
-        ent = r.get("licenseId")
-        trial_dt = _iso10(raw_by_ent.get(ent, {}).get("latestEvaluationStartDate")) if ent else None
-        if trial_dt:
-            r["trialStarted"] = trial_dt
-
-    # 2b) Normal single-day license rows (new starts etc.)
-    lic_items = fetch_licenses(VENDOR_ID, start_date, end_date)
-    lic_rows  = pick_new_evaluations(lic_items, start_date, end_date)
-
-    # 2c) Uninstalls (your existing path)
-    un_items = fetch_uninstalls(VENDOR_ID, start_date, end_date)
-    name_map = build_app_name_map(lic_items, un_items)
+
+    # 2b) Uninstalls (your existing path); the key -> name map is only a fallback for
+    #     feedback rows without an app name, so skip the extra scans when none lack one
+    needs_names = any(not (f.get("addonName") or (f.get("app") or _EMPTY).get("name")) for f in un_items or [])
+    name_map = build_app_name_map(lic_items, un_items) if needs_names else None
     un_rows   = pick_uninstalls(un_items, name_map=name_map, ent_map=ent_map)
 
-    # 2d) Merge conversions + de-dupe by licenseId so they don’t also appear under New licenses
+    # 2c) Normal single-day license rows (new starts etc.): de-dupe by licenseId so
+    #     conversions don’t also appear under New licenses. The id check runs on the raw
+    #     records, so those skip the customer/contact/date extraction entirely
     seen_ids = {r.get("licenseId") for r in conv_rows if r.get("licenseId")}
-    lic_rows_filtered = [r for r in lic_rows if r.get("licenseId") not in seen_ids]
-    lic_rows_final = conv_rows + lic_rows_filtered
+    if seen_ids:
+        lic_items = [lic for lic in lic_items if _extract_license_id(lic) not in seen_ids]
+    lic_rows_final = conv_rows + list(pick_new_evaluations(lic_items, start_date, end_date))
+    # the rows are the projection: drop the raw export dicts (dozens of keys each,
+    # mostly unused) before building the Slack message
+    del lic_items, un_items, inferred_raw, ent_map
 
     print(f"[INFO] Licenses mapped: {len(lic_rows_final)} | Conversions inferred: {len(conv_rows)} | Uninstalls mapped: {len(un_rows)}")
 
-    if not lic_rows_final and not un_rows:
-        slack_post({"text": f"ℹ️ No new licenses or uninstalls for {start_date} (UTC)."})
-        print("[INFO] No items; posted 'no changes' message to Slack.")
-        return
-
+    # one Slack path for every day: a quiet day posts the "no changes" message from there
     post_combined_to_slack(SLACK_WEBHOOK, lic_rows_final, un_rows, start_date, end_date)
 
 if __name__ == "__main__":
@@ -770,3 +1010,5 @@ if __name__ == "__main__":
         import traceback
         traceback.print_exc()  # log to GitHub Actions logs only
         raise
+    finally:
+        SESSION.close()  # release the pooled keep-alive connections